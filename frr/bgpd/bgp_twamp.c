@@ -123,8 +123,10 @@ void bgp_twamp_add_nexthop(struct in_addr *nh)
         shm->nexthops[shm->nh_count].addr.s_addr = nh->s_addr;
         shm->nexthops[shm->nh_count].active = 1;
         shm->nexthops[shm->nh_count].measured = 0;
-        shm->nexthops[shm->nh_count].padding[0] = 0;
-        shm->nexthops[shm->nh_count].padding[1] = 0;
+        memset(shm->nexthops[shm->nh_count].padding, 0,
+               sizeof(shm->nexthops[shm->nh_count].padding));
+        memset(shm->nexthops[shm->nh_count].padding2, 0,
+               sizeof(shm->nexthops[shm->nh_count].padding2));
         shm->nexthops[shm->nh_count].latency_ms = UINT32_MAX;  /* Max = not measured */
         shm->nexthops[shm->nh_count].last_updated = 0;
         shm->nh_count++;
@@ -167,6 +169,28 @@ void bgp_twamp_remove_nexthop(struct in_addr *nh)
 }
 
 
+/* The daemon publishes latency_ms and measured with one 64-bit store;
+ * load the word the same way so the pair is read as one snapshot */
+typedef uint64_t __attribute__((may_alias)) twamp_word_t;
+
+_Static_assert(offsetof(struct twamp_nexthop, latency_ms) % sizeof(twamp_word_t) == 0,
+               "latency_ms must start an aligned 64-bit word");
+_Static_assert(offsetof(struct twamp_nexthop, measured) + 1 -
+               offsetof(struct twamp_nexthop, latency_ms) <= sizeof(twamp_word_t),
+               "measured must share the latency_ms word");
+
+static void twamp_load_measurement(const struct twamp_nexthop *entry,
+                                   uint32_t *latency_ms, uint8_t *measured)
+{
+    twamp_word_t word = __atomic_load_n((const twamp_word_t *)&entry->latency_ms,
+                                        __ATOMIC_RELAXED);
+    const uint8_t *bytes = (const uint8_t *)&word;
+
+    memcpy(latency_ms, bytes, sizeof(*latency_ms));
+    *measured = bytes[offsetof(struct twamp_nexthop, measured) -
+                      offsetof(struct twamp_nexthop, latency_ms)];
+}
+
 /* Get latency for a next-hop */
 uint32_t bgp_twamp_get_latency(struct in_addr *nh)
 {
@@ -187,21 +211,25 @@ uint32_t bgp_twamp_get_latency(struct in_addr *nh)
     
     for (i = 0; i < (int)shm->nh_count; i++) {
         char stored_ip[INET_ADDRSTRLEN];
+        uint8_t measured;
+        
+        /* Snapshot the pair once; the daemon writes it without the lock */
+        twamp_load_measurement(&shm->nexthops[i], &latency, &measured);
+        
         inet_ntop(AF_INET, &shm->nexthops[i].addr, stored_ip, sizeof(stored_ip));
         fprintf(stderr, "*** RAW BYTES: addr=%08x lat=%u act=%u meas=%u\n", 
                 ntohl(shm->nexthops[i].addr.s_addr), 
-                shm->nexthops[i].latency_ms, 
+                latency, 
                 shm->nexthops[i].active, 
-                shm->nexthops[i].measured); fflush(stderr);
+                measured); fflush(stderr);
         fprintf(stderr, "*** GET_LATENCY:   [%d] %s: latency=%u active=%d measured=%d\n", 
-                i, stored_ip, shm->nexthops[i].latency_ms, 
-                shm->nexthops[i].active, shm->nexthops[i].measured); 
+                i, stored_ip, latency, 
+                shm->nexthops[i].active, measured); 
         fflush(stderr);
         
         if (shm->nexthops[i].addr.s_addr == nh->s_addr && 
-            shm->nexthops[i].measured &&
+            measured &&
             shm->nexthops[i].active) {
-            latency = shm->nexthops[i].latency_ms;
             fprintf(stderr, "*** GET_LATENCY: FOUND! Returning %u ms\n", latency); fflush(stderr);
             pthread_mutex_unlock(&shm->lock);
             return latency;
@@ -26,16 +26,22 @@ extern "C" {
 
 #define TWAMP_SHM_NAME "/bgp_twamp_shm"
 #define MAX_NEXTHOPS 1024
+#define TWAMP_CACHELINE_SIZE 64
 
 
 struct twamp_nexthop {
     struct in_addr addr;    
-    uint32_t latency_ms;     
     uint8_t active;          
+    uint8_t padding[3];    
+    /* latency_ms and measured share one aligned 64-bit word that the
+     * TWAMP daemon updates with a single store; read both with one
+     * 64-bit load (bgp_twamp_get_latency) to see a consistent pair */
+    uint32_t latency_ms;     
     uint8_t measured;        
-    uint8_t padding[2];    
+    uint8_t padding2[3];
     time_t last_updated;     
-};
+    uint8_t pad2[40];        /* one entry per cache line, no false sharing */
+} __attribute__((aligned(TWAMP_CACHELINE_SIZE)));
 
 
 struct twamp_shm {
@@ -43,6 +49,7 @@ struct twamp_shm {
     uint32_t nh_count;                
     uint32_t sequence;                 
     uint32_t padding;                
+    /* header is padded up to the first cache line boundary */
     struct twamp_nexthop nexthops[MAX_NEXTHOPS];
 };
 
@@ -4,15 +4,24 @@ TWAMP Daemon for BGP Latency-Based Path Selection
 Reads next-hops from shared memory and measures latency using TWAMP Light
 """
 
+import os
 import sys
 import time
+import errno
 import struct
 import socket
+import select
 import mmap
 import argparse
 import signal
+import selectors
+import itertools
+import threading
+import ctypes
 from datetime import datetime
-from ctypes import Structure, c_uint8, c_uint32, c_uint64
+import numpy as np
+from ctypes import (Structure, c_char, c_int, c_uint, c_uint8, c_uint16, c_uint32,
+                    c_uint64, c_size_t, c_void_p, sizeof)
 
 # Constants
 TWAMP_SHM_NAME = "/bgp_twamp_shm"
@@ -21,16 +30,21 @@ DEFAULT_PROBE_CYCLE = 30  # seconds
 DEFAULT_PACKET_COUNT = 3
 DEFAULT_TIMEOUT = 1.0  # seconds
 TWAMP_PORT = 862
+PROBE_SOCKET_BUFFER = 4 << 20  # bytes, SO_RCVBUF/SO_SNDBUF (capped by net.core.*mem_max)
+PROBE_INFLIGHT_COST = 4096  # receive buffer bytes per probe in flight: reply + TX timestamp, 2x headroom
+CACHELINE_SIZE = 64  # TWAMP_CACHELINE_SIZE in bgp_twamp_ipc.h
 
-# Shared memory structure (matches C struct)
+# Shared memory structure (matches struct twamp_nexthop in bgp_twamp_ipc.h)
 class NexthopEntry(Structure):
     _fields_ = [
         ('addr', c_uint32),           # IPv4 address (network byte order)
         ('active', c_uint8),
+        ('padding', c_uint8 * 3),
+        ('latency_ms', c_uint32),     # latency_ms + measured: one aligned 64-bit word
         ('measured', c_uint8),
-        ('padding', c_uint8 * 2),
-        ('latency_ms', c_uint32),
-        ('last_updated', c_uint64)
+        ('padding2', c_uint8 * 3),
+        ('last_updated', c_uint64),   # time_t, 8-byte aligned
+        ('pad2', c_uint8 * 40)        # one entry per cache line
     ]
 
 class TwampShm(Structure):
@@ -39,78 +53,393 @@ class TwampShm(Structure):
         ('nh_count', c_uint32),
         ('sequence', c_uint32),
         ('padding', c_uint32),
+        ('pad2', c_uint8 * 12),       # nexthops start on a cache line boundary
         ('nexthops', NexthopEntry * MAX_NEXTHOPS)
     ]
 
-# Global flag for graceful shutdown
-running = True
+# sendmmsg() structures (Linux)
+class Iovec(Structure):
+    _fields_ = [
+        ('iov_base', c_void_p),
+        ('iov_len', c_size_t)
+    ]
+
+class Msghdr(Structure):
+    _fields_ = [
+        ('msg_name', c_void_p),
+        ('msg_namelen', c_uint32),
+        ('msg_iov', c_void_p),
+        ('msg_iovlen', c_size_t),
+        ('msg_control', c_void_p),
+        ('msg_controllen', c_size_t),
+        ('msg_flags', c_int)
+    ]
+
+class Mmsghdr(Structure):
+    _fields_ = [
+        ('msg_hdr', Msghdr),
+        ('msg_len', c_uint)
+    ]
+
+class SockaddrIn(Structure):
+    _fields_ = [
+        ('sin_family', c_uint16),
+        ('sin_port', c_uint16),       # network byte order
+        ('sin_addr', c_uint8 * 4),
+        ('sin_zero', c_uint8 * 8)
+    ]
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_sendmmsg = getattr(_libc, 'sendmmsg', None)
+if _sendmmsg is not None:
+    _sendmmsg.argtypes = [c_int, c_void_p, c_uint, c_int]
+    _sendmmsg.restype = c_int
+
+# Shared memory layout, taken from the ctypes mirror so alignment matches C
+NH_COUNT_OFFSET = TwampShm.nh_count.offset
+NEXTHOPS_OFFSET = TwampShm.nexthops.offset
+NEXTHOP_ENTRY_SIZE = sizeof(NexthopEntry)
+assert NEXTHOPS_OFFSET % CACHELINE_SIZE == 0 and NEXTHOP_ENTRY_SIZE == CACHELINE_SIZE
+
+# The C side writes host (little-endian) order; only addr is network order.
+_COUNT_STRUCT = struct.Struct('<I')
+
+# Entry updates are single aligned 64-bit stores (atomic on x86-64), so the
+# daemon can write without the mutex and bgpd never reads a torn value.
+# Word indexes within an entry; latency_ms is the low half of its word.
+WORDS_PER_ENTRY = NEXTHOP_ENTRY_SIZE // 8
+MEASUREMENT_WORD = NexthopEntry.latency_ms.offset // 8
+MEASURED_SHIFT = (NexthopEntry.measured.offset - NexthopEntry.latency_ms.offset) * 8
+LAST_UPDATED_WORD = NexthopEntry.last_updated.offset // 8
+assert NexthopEntry.latency_ms.offset % 8 == 0 and MEASURED_SHIFT < 64
+
+# TWAMP Light probe: seq_num, timestamp, padding
+_PROBE_STRUCT = struct.Struct('!IQQ')
+_probe_seq = itertools.count(1)  # unique across targets and cycles
+
+# Kernel timestamping (Linux values; not all are exported by the socket module)
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35)
+SO_TIMESTAMPING = getattr(socket, 'SO_TIMESTAMPING', 37)
+SOF_TIMESTAMPING_TX_SOFTWARE = 1 << 1
+SOF_TIMESTAMPING_SOFTWARE = 1 << 4
+SOF_TIMESTAMPING_OPT_ID = 1 << 7
+SOF_TIMESTAMPING_OPT_TSONLY = 1 << 11
+IP_RECVERR = getattr(socket, 'IP_RECVERR', 11)
+SO_EE_ORIGIN_TIMESTAMPING = 4
+CMSG_BUF_SIZE = 512
+_TIMESPEC_STRUCT = struct.Struct('@ll')                 # struct timespec
+_SOCK_EXTENDED_ERR_STRUCT = struct.Struct('@IBBBBII')  # struct sock_extended_err
+
+# numpy view of a NexthopEntry (padding bytes are left out of the field list)
+NH_DTYPE = np.dtype({
+    'names': ['addr', 'active', 'latency_ms', 'measured', 'last_updated'],
+    'formats': ['<u4', 'u1', '<u4', 'u1', '<u8'],
+    'offsets': [NexthopEntry.addr.offset,
+                NexthopEntry.active.offset,
+                NexthopEntry.latency_ms.offset,
+                NexthopEntry.measured.offset,
+                NexthopEntry.last_updated.offset],
+    'itemsize': NEXTHOP_ENTRY_SIZE
+})
+
+# Dotted-quad text for every octet value
+_OCTET_STR = [str(i) for i in range(256)]
+
+# Set by the signal handler for graceful shutdown; also wakes the cycle sleep
+_stop = threading.Event()
 
 def signal_handler(sig, frame):
     """Handle Ctrl+C gracefully"""
-    global running
     print("\n\nShutting down TWAMP daemon...")
-    running = False
+    _stop.set()
+
+def ips_to_strings(addrs):
+    """Convert an array of addr values from shared memory to IP strings"""
+    # addr is stored in network byte order, so its bytes are already the octets in order
+    octets = np.ascontiguousarray(addrs).view(np.uint8).reshape(-1, 4)
+    return ['.'.join([_OCTET_STR[o] for o in row]) for row in octets.tolist()]
+
+def enable_kernel_timestamps(sock):
+    """Ask the kernel to timestamp received (SO_TIMESTAMPNS) and sent (SO_TIMESTAMPING) packets"""
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPING,
+                        SOF_TIMESTAMPING_TX_SOFTWARE | SOF_TIMESTAMPING_SOFTWARE |
+                        SOF_TIMESTAMPING_OPT_ID | SOF_TIMESTAMPING_OPT_TSONLY)
+        return True
+    except OSError as e:
+        print(f"  Kernel timestamps unavailable, using user-space clock: {e}")
+        return False
 
-def ip_to_string(ip_int):
-    """Convert 32-bit integer to IP string"""
-    return socket.inet_ntoa(struct.pack('!I', ip_int))
+def cmsg_timestamp_ns(ancdata):
+    """Extract the SCM_TIMESTAMPNS kernel timestamp (ns) from recvmsg ancillary data"""
+    for level, cmsg_type, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and cmsg_type == SO_TIMESTAMPNS:
+            sec, nsec = _TIMESPEC_STRUCT.unpack_from(cmsg_data)
+            return sec * 1_000_000_000 + nsec
+    return None
 
-def measure_twamp_light(target_ip, port=TWAMP_PORT, count=3, timeout=1.0):
+def read_tx_timestamps(sock, tx_keys, tx_ns):
     """
-    Simple TWAMP Light implementation
-    Sends UDP packets and measures round-trip time
+    Drain TX timestamp completions from the socket error queue
+    tx_keys maps the kernel's per-send OPT_ID key to our seq_num;
+    kernel send times are stored in tx_ns by seq_num
+    """
+    while True:
+        try:
+            _, ancdata, _, _ = sock.recvmsg(0, CMSG_BUF_SIZE, socket.MSG_ERRQUEUE)
+        except (BlockingIOError, InterruptedError):
+            return
+        
+        ts_ns = cmsg_timestamp_ns(ancdata)
+        for level, cmsg_type, cmsg_data in ancdata:
+            if level == socket.IPPROTO_IP and cmsg_type == IP_RECVERR:
+                _, origin, _, _, _, _, key = _SOCK_EXTENDED_ERR_STRUCT.unpack_from(cmsg_data)
+                seq_num = tx_keys.pop(key, None)
+                if origin == SO_EE_ORIGIN_TIMESTAMPING and seq_num is not None and ts_ns:
+                    tx_ns[seq_num] = ts_ns
+
+def read_probe_replies(sock, pending, rx_ns):
+    """
+    Drain queued probe replies without blocking
+    Answered seq_nums are removed from pending; receive times are stored
+    in rx_ns by seq_num
+    """
+    while True:
+        try:
+            data, ancdata, _, addr = sock.recvmsg(1024, CMSG_BUF_SIZE)
+        except BlockingIOError:
+            return
+        end_ns = cmsg_timestamp_ns(ancdata) or time.time_ns()
+        
+        if len(data) < _PROBE_STRUCT.size:
+            continue
+        
+        seq_num = _PROBE_STRUCT.unpack_from(data)[0]
+        if seq_num not in pending:
+            continue  # late reply from an earlier cycle
+        
+        pending.discard(seq_num)
+        rx_ns[seq_num] = end_ns
+
+def send_probe_batch(sock, buf, dests, size):
+    """
+    Send one size-byte probe from buf to each destination, in order,
+    with as few sendmmsg() calls as possible
+    
+    Returns: list of booleans, True where the probe was sent
+    """
+    count = len(dests)
+    sent = [False] * count
+    
+    if _sendmmsg is None:
+        # No sendmmsg() in this libc, fall back to one sendto() per probe
+        view = memoryview(buf)
+        for i, dest in enumerate(dests):
+            try:
+                sock.sendto(view[i * size:(i + 1) * size], dest)
+                sent[i] = True
+            except OSError as e:
+                print(f"  Error sending to {dest[0]}: {e}")
+        return sent
+    
+    addrs = (SockaddrIn * count)()
+    iovs = (Iovec * count)()
+    msgs = (Mmsghdr * count)()
+    buf_addr = ctypes.addressof(buf)
+    
+    for i, (target_ip, port) in enumerate(dests):
+        addrs[i].sin_family = socket.AF_INET
+        addrs[i].sin_port = socket.htons(port)
+        addrs[i].sin_addr[:] = socket.inet_aton(target_ip)
+        iovs[i].iov_base = buf_addr + i * size
+        iovs[i].iov_len = size
+        msgs[i].msg_hdr.msg_name = ctypes.addressof(addrs[i])
+        msgs[i].msg_hdr.msg_namelen = sizeof(SockaddrIn)
+        msgs[i].msg_hdr.msg_iov = ctypes.addressof(iovs[i])
+        msgs[i].msg_hdr.msg_iovlen = 1
+    
+    fd = sock.fileno()
+    i = 0
+    while i < count:
+        rc = _sendmmsg(fd, ctypes.addressof(msgs) + i * sizeof(Mmsghdr), count - i, 0)
+        if rc > 0:
+            sent[i:i + rc] = [True] * rc
+            i += rc
+            continue
+        
+        err = ctypes.get_errno()
+        if err == errno.EINTR:
+            continue
+        if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+            # Send buffer full, wait for it to drain
+            if select.select([], [sock], [], 1.0)[1]:
+                continue
+        
+        # sendmmsg() stopped at message i; report it and carry on after it
+        print(f"  Error sending to {dests[i][0]}: {os.strerror(err)}")
+        i += 1
+    
+    return sent
+
+class ProbeSocket:
+    """
+    Non-blocking UDP socket shared by every probe for the daemon's lifetime,
+    with its selector and the next kernel TX timestamp key (OPT_ID keys
+    count per socket, so they must persist with it)
+    """
+    
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        
+        # Ask for large buffers; the kernel silently caps them at
+        # net.core.rmem_max/wmem_max, so read back what was granted
+        # (getsockopt reports twice the usable size)
+        for opt, limit in ((socket.SO_RCVBUF, 'net.core.rmem_max'),
+                           (socket.SO_SNDBUF, 'net.core.wmem_max')):
+            self.sock.setsockopt(socket.SOL_SOCKET, opt, PROBE_SOCKET_BUFFER)
+            granted = self.sock.getsockopt(socket.SOL_SOCKET, opt) // 2
+            if granted < PROBE_SOCKET_BUFFER:
+                print(f"  Probe socket buffer capped at {granted} bytes "
+                      f"(requested {PROBE_SOCKET_BUFFER}); raise {limit} for larger bursts")
+        
+        # Replies and TX timestamps share the receive buffer the kernel
+        # actually granted; cap the probes sent between drains to fit it
+        self.rcvbuf = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        self.window = max(1, self.rcvbuf // PROBE_INFLIGHT_COST)
+        
+        self.kernel_ts = enable_kernel_timestamps(self.sock)
+        self.tx_key = 0
+        
+        self.sel = selectors.DefaultSelector()
+        self.sel.register(self.sock, selectors.EVENT_READ)
     
-    Returns: average latency in milliseconds, or None if failed
+    def close(self):
+        self.sel.close()
+        self.sock.close()
+
+def measure_all_twamp(probe, targets, count=3, timeout=1.0, port=TWAMP_PORT, verbose=False):
+    """
+    TWAMP Light measurement of many targets over one ProbeSocket
+    Sends count UDP packets to every target in chunks of at most probe.window,
+    draining replies between chunks so the receive buffer cannot overflow,
+    then matches replies by sequence number in a single selectors (epoll)
+    loop. RTTs use kernel send/receive timestamps, so interpreter stalls
+    do not inflate them.
+    Per-packet results are only printed when verbose is set.
+    
+    Returns: list of average latency in whole milliseconds, rounded
+             (or None if failed), one per target in the same order
     """
-    rtts = []
+    rtt_sum_ns = [0] * len(targets)
+    replies = [0] * len(targets)
+    send_ts = {}  # seq_num -> (target index, packet number, send time ns)
+    tx_keys = {}  # kernel OPT_ID key -> seq_num
+    tx_ns = {}    # seq_num -> kernel send time ns
+    rx_ns = {}    # seq_num -> receive time ns
+    
+    sock = probe.sock
     
     try:
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.settimeout(timeout)
+        # Pack every probe into one buffer
+        probes = []  # (seq_num, target index, packet number)
+        dests = []
+        buf = (c_char * (len(targets) * count * _PROBE_STRUCT.size))()
+        timestamp = int(time.time() * 1_000_000)  # microseconds
+        
+        for t_idx, target_ip in enumerate(targets):
+            for i in range(count):
+                # TWAMP Light packet format (simplified)
+                # Sequence number (4 bytes) + Timestamp (8 bytes) + Padding (8 bytes)
+                seq_num = next(_probe_seq) & 0xFFFFFFFF
+                _PROBE_STRUCT.pack_into(buf, len(probes) * _PROBE_STRUCT.size,
+                                        seq_num, timestamp, 0)
+                probes.append((seq_num, t_idx, i + 1))
+                dests.append((target_ip, port))
         
-        for i in range(count):
-            # TWAMP Light packet format (simplified)
-            # Sequence number (4 bytes) + Timestamp (8 bytes) + Padding (8 bytes)
-            seq_num = i + 1
-            timestamp = int(time.time() * 1_000_000)  # microseconds
+        pending = set()
+        size = _PROBE_STRUCT.size
+        for start in range(0, len(probes), probe.window):
+            chunk = probes[start:start + probe.window]
+            chunk_buf = (c_char * (len(chunk) * size)).from_buffer(buf, start * size)
             
-            packet = struct.pack('!IQQ', seq_num, timestamp, 0)
+            # Wall clock matches the kernel's timestamp clock; it is only
+            # used if no kernel TX timestamp arrives
+            start_ns = time.time_ns()
+            sent = send_probe_batch(sock, chunk_buf, dests[start:start + len(chunk)], size)
             
-            # Send packet and measure RTT
-            start_time = time.perf_counter()
+            for (seq_num, t_idx, pkt_num), ok in zip(chunk, sent):
+                if not ok:
+                    continue
+                send_ts[seq_num] = (t_idx, pkt_num, start_ns)
+                pending.add(seq_num)
+                if probe.kernel_ts:
+                    tx_keys[probe.tx_key] = seq_num
+                    probe.tx_key += 1
             
-            try:
-                sock.sendto(packet, (target_ip, port))
-                data, addr = sock.recvfrom(1024)
-                
-                end_time = time.perf_counter()
-                rtt_ms = (end_time - start_time) * 1000
-                rtts.append(rtt_ms)
-                
-                print(f"  Packet {seq_num}: {rtt_ms:.2f} ms")
-                
-            except socket.timeout:
-                print(f"  Packet {seq_num}: Timeout")
+            # Free the receive buffer before the next chunk
+            if probe.kernel_ts:
+                read_tx_timestamps(sock, tx_keys, tx_ns)
+            read_probe_replies(sock, pending, rx_ns)
+        
+        # Drain replies until every probe is answered or the timeout expires
+        deadline = time.monotonic() + timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            if not probe.sel.select(remaining):
                 continue
             
-            # Small delay between packets
-            if i < count - 1:
-                time.sleep(0.01)
+            if probe.kernel_ts:
+                read_tx_timestamps(sock, tx_keys, tx_ns)
+            read_probe_replies(sock, pending, rx_ns)
+        
+        if probe.kernel_ts:
+            read_tx_timestamps(sock, tx_keys, tx_ns)
+    
+    except Exception as e:
+        print(f"  Error measuring next-hops: {e}")
+        return [None] * len(targets)
+    
+    for seq_num, (t_idx, pkt_num, start_ns) in send_ts.items():
+        if seq_num not in rx_ns:
+            if verbose:
+                print(f"  {targets[t_idx]} packet {pkt_num}: Timeout")
+            continue
         
-        sock.close()
+        # Integer nanoseconds throughout; converted to ms once per target
+        rtt_ns = rx_ns[seq_num] - tx_ns.get(seq_num, start_ns)
+        rtt_sum_ns[t_idx] += rtt_ns
+        replies[t_idx] += 1
         
-        if rtts:
-            avg_rtt = sum(rtts) / len(rtts)
-            loss_pct = ((count - len(rtts)) / count) * 100
-            print(f"  Average RTT: {avg_rtt:.2f} ms, Loss: {loss_pct:.0f}%")
-            return avg_rtt
+        if verbose:
+            print(f"  {targets[t_idx]} packet {pkt_num}: {rtt_ns / 1_000_000:.2f} ms")
+    
+    results = []
+    for target_ip, sum_ns, received in zip(targets, rtt_sum_ns, replies):
+        if received:
+            # Mean RTT rounded to the nearest ms
+            avg_ms = (sum_ns + received * 500_000) // (received * 1_000_000)
+            loss_pct = ((count - received) / count) * 100
+            print(f"  {target_ip} average RTT: {sum_ns / received / 1_000_000:.2f} ms, "
+                  f"Loss: {loss_pct:.0f}%")
+            results.append(avg_ms)
         else:
-            print(f"  All packets lost")
-            return None
-            
-    except Exception as e:
-        print(f"  Error measuring {target_ip}: {e}")
-        return None
+            print(f"  {target_ip}: All packets lost")
+            results.append(None)
+    
+    return results
+
+def measure_twamp_light(probe, target_ip, port=TWAMP_PORT, count=3, timeout=1.0, verbose=False):
+    """
+    Simple TWAMP Light implementation
+    Sends UDP packets and measures round-trip time
+    
+    Returns: average latency in whole milliseconds, or None if failed
+    """
+    return measure_all_twamp(probe, [target_ip], count, timeout, port, verbose)[0]
 
 def open_shared_memory():
     """Open and map shared memory"""
@@ -118,8 +447,25 @@ def open_shared_memory():
         # Open shared memory file
         shm_fd = open(TWAMP_SHM_NAME, 'r+b')
         
-        # Memory map the file
-        shm_map = mmap.mmap(shm_fd.fileno(), 0)
+        # Memory map the file, prefaulting pages so the measurement
+        # cycle does not take first-touch faults (MAP_POPULATE is Linux-only)
+        flags = mmap.MAP_SHARED | getattr(mmap, 'MAP_POPULATE', 0)
+        shm_map = mmap.mmap(shm_fd.fileno(), 0, flags=flags)
+        
+        # A bgpd built against another bgp_twamp_ipc.h creates a smaller table
+        if len(shm_map) < sizeof(TwampShm):
+            print(f"Error: bgpd/daemon layout mismatch: shared memory is {len(shm_map)} bytes, "
+                  f"expected {sizeof(TwampShm)}")
+            print("Rebuild bgpd and the daemon from the same bgp_twamp_ipc.h.")
+            shm_map.close()
+            shm_fd.close()
+            return None, None
+        
+        # Entries are accessed by index: keep them resident, skip readahead
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            shm_map.madvise(mmap.MADV_WILLNEED)
+        if hasattr(mmap, 'MADV_RANDOM'):
+            shm_map.madvise(mmap.MADV_RANDOM)
         
         print("TWAMP Daemon: Connected to shared memory")
         return shm_fd, shm_map
@@ -133,125 +479,77 @@ def open_shared_memory():
         print(f"Error opening shared memory: {e}")
         return None, None
 
-def read_nexthop_count(shm_map):
+def read_nexthop_count(shm_mv):
     """Read next-hop count from shared memory"""
-    # Skip pthread_mutex (40 bytes), read nh_count (4 bytes)
-    offset = 40
-    count = struct.unpack('I', shm_map[offset:offset+4])[0]
+    # Skip pthread_mutex (40 bytes), read nh_count (4 bytes) without copying
+    count = _COUNT_STRUCT.unpack_from(shm_mv, NH_COUNT_OFFSET)[0]
     return count
 
-def read_nexthop(shm_map, index):
-    """Read a single next-hop entry"""
-    # Calculate offset: 40 (mutex) + 12 (nh_count, sequence, padding) + index * entry_size
-    entry_size = 24  # sizeof(NexthopEntry)
-    base_offset = 40 + 12
-    offset = base_offset + (index * entry_size)
-    
-    # Read entry: addr(4) + active(1) + measured(1) + padding(2) + latency(4) + last_updated(8)
-    data = shm_map[offset:offset+entry_size]
-    addr, active, measured, pad1, pad2, latency, last_updated = struct.unpack('!IBBHIQ', data)
-    
-    return {
-        'addr': addr,
-        'active': active,
-        'measured': measured,
-        'latency_ms': latency,
-        'last_updated': last_updated
-    }
-
-def write_nexthop_latency(shm_map, index, latency_ms):
-    """Update next-hop latency in shared memory"""
-    entry_size = 24
-    base_offset = 40 + 12
-    offset = base_offset + (index * entry_size)
-    
-    # Read current entry
-    nh = read_nexthop(shm_map, index)
-    
-    # Update measured flag, latency, and timestamp
-    measured = 1
-    last_updated = int(time.time())
-    
-    # Write back: addr(4) + active(1) + measured(1) + padding(2) + latency(4) + last_updated(8)
-    data = struct.pack('!IBBHIQ', 
-                      nh['addr'], 
-                      nh['active'], 
-                      measured, 
-                      0, 0,  # padding
-                      latency_ms, 
-                      last_updated)
-    
-    shm_map[offset:offset+entry_size] = data
-
-def mark_nexthop_failed(shm_map, index):
-    """Mark next-hop as failed (unmeasured)"""
-    entry_size = 24
-    base_offset = 40 + 12
-    offset = base_offset + (index * entry_size)
-    
-    # Read current entry
-    nh = read_nexthop(shm_map, index)
-    
-    # Update measured flag and set latency to max
-    measured = 0
-    latency_ms = 0xFFFFFFFF  # UINT32_MAX
-    
-    data = struct.pack('!IBBHIQ', 
-                      nh['addr'], 
-                      nh['active'], 
-                      measured, 
-                      0, 0,
-                      latency_ms, 
-                      nh['last_updated'])
-    
-    shm_map[offset:offset+entry_size] = data
-
-def run_measurement_cycle(shm_map, packet_count):
+def open_nexthop_array(shm_mv):
+    """Map the next-hop table as a zero-copy structured array over shared memory"""
+    return np.frombuffer(shm_mv, dtype=NH_DTYPE, count=MAX_NEXTHOPS,
+                         offset=NEXTHOPS_OFFSET)
+
+def open_nexthop_words(nh_arr):
+    """View the next-hop table as native 64-bit words for single-store updates"""
+    return (c_uint64 * (nh_arr.nbytes // 8)).from_buffer(nh_arr)
+
+def write_nexthop_latency(nh_words, index, latency_ms, now):
+    """Update next-hop latency in shared memory, stamped with now (epoch seconds)"""
+    # latency_ms and measured=1 land together in one store; addr/active are untouched
+    base = index * WORDS_PER_ENTRY
+    nh_words[base + MEASUREMENT_WORD] = latency_ms | (1 << MEASURED_SHIFT)
+    nh_words[base + LAST_UPDATED_WORD] = now
+
+def mark_nexthop_failed(nh_words, index):
+    """Mark next-hop as failed (unmeasured), keeping last_updated"""
+    # measured=0 with latency UINT32_MAX, as one store
+    nh_words[index * WORDS_PER_ENTRY + MEASUREMENT_WORD] = 0xFFFFFFFF
+
+def run_measurement_cycle(shm_mv, nh_arr, nh_words, probe, packet_count, verbose=False):
     """Run one complete measurement cycle"""
     print("\n=== TWAMP Measurement Cycle ===")
     print(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
     
     # Read next-hop count
-    count = read_nexthop_count(shm_map)
+    count = min(read_nexthop_count(shm_mv), MAX_NEXTHOPS)
     
     if count == 0:
         print("No next-hops to measure.")
         return
     
-    print(f"Measuring {count} next-hops...")
+    # Select active next-hops with one vectorized test over the active column
+    active_idx = np.flatnonzero(nh_arr['active'][:count])
+    
+    if len(active_idx) == 0:
+        print(f"No active next-hops to measure ({count} inactive).")
+        return
+    
+    print(f"Measuring {len(active_idx)}/{count} active next-hops...")
     
     measured_count = 0
     
-    # Measure each active next-hop
-    for i in range(count):
-        nh = read_nexthop(shm_map, i)
-        
-        if not nh['active']:
-            continue
-        
-        ip_str = ip_to_string(nh['addr'])
+    # Snapshot active next-hops, then probe them all in one event loop
+    targets = list(zip(active_idx.tolist(), ips_to_strings(nh_arr['addr'][active_idx])))
+    latencies = measure_all_twamp(probe, [ip_str for _, ip_str in targets],
+                                  packet_count, DEFAULT_TIMEOUT, verbose=verbose)
+    
+    # Write results back sequentially, all stamped with one timestamp
+    now = int(time.time())
+    for (i, ip_str), latency_ms in zip(targets, latencies):
         print(f"\nNext-hop {i+1}: {ip_str}")
         
-        # Perform measurement
-        latency = measure_twamp_light(ip_str, TWAMP_PORT, packet_count)
-        
-        if latency is not None:
-            latency_ms = int(latency + 0.5)  # Round to nearest ms
-            write_nexthop_latency(shm_map, i, latency_ms)
+        if latency_ms is not None:
+            write_nexthop_latency(nh_words, i, latency_ms, now)
             measured_count += 1
             print(f"  ✓ Updated shared memory: {latency_ms} ms")
         else:
-            mark_nexthop_failed(shm_map, i)
+            mark_nexthop_failed(nh_words, i)
             print(f"  ✗ Marked as failed")
-        
-        # Small delay between measurements
-        time.sleep(1)
     
-    print(f"\nMeasurement cycle complete: {measured_count}/{count} next-hops measured successfully")
+    print(f"\nMeasurement cycle complete: {measured_count}/{len(targets)} active next-hops measured successfully")
 
 def main():
-    global running
-    
     parser = argparse.ArgumentParser(
         description='TWAMP measurement daemon for BGP latency-based path selection'
     )
@@ -259,6 +557,8 @@ def main():
                        help=f'Probe cycle interval in seconds (default: {DEFAULT_PROBE_CYCLE})')
     parser.add_argument('-p', '--packets', type=int, default=DEFAULT_PACKET_COUNT,
                        help=f'Packets per measurement (default: {DEFAULT_PACKET_COUNT})')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                       help='Print per-packet probe results')
     
     args = parser.parse_args()
     
@@ -281,28 +581,42 @@ def main():
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
+    # One probe socket for every target and cycle
+    try:
+        probe = ProbeSocket()
+    except OSError as e:
+        print(f"Error creating probe socket: {e}")
+        return 1
+    
     # Open shared memory
     shm_fd, shm_map = open_shared_memory()
     if shm_map is None:
+        probe.close()
         return 1
     
+    # One view of the mapping shared by every reader
+    shm_mv = memoryview(shm_map)
+    nh_arr = open_nexthop_array(shm_mv)
+    nh_words = open_nexthop_words(nh_arr)
+    
     print("Starting measurement loop (Ctrl+C to stop)...\n")
     
     # Main measurement loop
     try:
-        while running:
-            run_measurement_cycle(shm_map, args.packets)
+        while not _stop.is_set():
+            run_measurement_cycle(shm_mv, nh_arr, nh_words, probe, args.packets, args.verbose)
             
-            if running:
+            if not _stop.is_set():
                 print(f"\nNext measurement in {args.cycle} seconds...")
-                
-                # Sleep with checks for shutdown
-                for _ in range(args.cycle):
-                    if not running:
-                        break
-                    time.sleep(1)
+            
+            # Sleep until the next cycle, returning early on shutdown
+            if _stop.wait(args.cycle):
+                break
         
     finally:
+        probe.close()
+        del nh_words, nh_arr  # release the buffer exports before unmapping
+        shm_mv.release()
         shm_map.close()
         shm_fd.close()
         print("Goodbye!")
@@ -4,71 +4,346 @@ Simple TWAMP Light Reflector
 Listens on all interfaces (0.0.0.0) and reflects packets back
 """
 
+import os
 import socket
 import struct
 import time
+import errno
 import signal
+import selectors
+import argparse
+import ctypes
 import sys
+from ctypes import Structure, c_char, c_int, c_uint, c_uint8, c_uint16, c_uint32, c_size_t, c_void_p, sizeof
 
 TWAMP_PORT = 862
+RECV_BUF_SIZE = 2048
+BATCH_SIZE = 64  # packets per recvmmsg()/sendmmsg() call
 running = True
 
+_SEQ_STRUCT = struct.Struct('!I')
+
+# recvmmsg()/sendmmsg() structures (Linux)
+class Iovec(Structure):
+    _fields_ = [
+        ('iov_base', c_void_p),
+        ('iov_len', c_size_t)
+    ]
+
+class Msghdr(Structure):
+    _fields_ = [
+        ('msg_name', c_void_p),
+        ('msg_namelen', c_uint32),
+        ('msg_iov', c_void_p),
+        ('msg_iovlen', c_size_t),
+        ('msg_control', c_void_p),
+        ('msg_controllen', c_size_t),
+        ('msg_flags', c_int)
+    ]
+
+class Mmsghdr(Structure):
+    _fields_ = [
+        ('msg_hdr', Msghdr),
+        ('msg_len', c_uint)
+    ]
+
+class SockaddrIn(Structure):
+    _fields_ = [
+        ('sin_family', c_uint16),
+        ('sin_port', c_uint16),       # network byte order
+        ('sin_addr', c_uint8 * 4),
+        ('sin_zero', c_uint8 * 8)
+    ]
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_recvmmsg = getattr(_libc, 'recvmmsg', None)
+_sendmmsg = getattr(_libc, 'sendmmsg', None)
+if _recvmmsg is not None and _sendmmsg is not None:
+    _recvmmsg.argtypes = [c_int, c_void_p, c_uint, c_int, c_void_p]
+    _recvmmsg.restype = c_int
+    _sendmmsg.argtypes = [c_int, c_void_p, c_uint, c_int]
+    _sendmmsg.restype = c_int
+
+class MmsgBatch:
+    """
+    Preallocated recvmmsg()/sendmmsg() slots: one buffer, iovec and source
+    address per packet. Replies are sent from the same slots, so a received
+    batch is echoed back without copying.
+    """
+    
+    def __init__(self, size=BATCH_SIZE):
+        self.size = size
+        self.bufs = (c_char * (size * RECV_BUF_SIZE))()
+        self.addrs = (SockaddrIn * size)()
+        self.iovs = (Iovec * size)()
+        self.msgs = (Mmsghdr * size)()
+        self.out = (Mmsghdr * size)()  # compacted send list when packets are dropped
+        self.dropped = 0  # replies that could not be sent, reported in the rate summary
+        
+        bufs_addr = ctypes.addressof(self.bufs)
+        for i in range(size):
+            self.iovs[i].iov_base = bufs_addr + i * RECV_BUF_SIZE
+            self.iovs[i].iov_len = RECV_BUF_SIZE
+            hdr = self.msgs[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self.addrs[i])
+            hdr.msg_namelen = sizeof(SockaddrIn)
+            hdr.msg_iov = ctypes.addressof(self.iovs[i])
+            hdr.msg_iovlen = 1
+            self.out[i].msg_hdr.msg_iovlen = 1
+
 def signal_handler(sig, frame):
     global running
     print("\nShutting down reflector...")
     running = False
 
-def main():
-    global running
-    
-    print("=== TWAMP Light Reflector ===")
-    print(f"Listening on 0.0.0.0:{TWAMP_PORT} (all interfaces)\n")
-    
-    signal.signal(signal.SIGINT, signal_handler)
-    signal.signal(signal.SIGTERM, signal_handler)
-    
-    # Create UDP socket
+def open_reflector_socket():
+    """Create a non-blocking UDP socket bound to the TWAMP port"""
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     
+    # Each worker binds its own socket; the kernel hashes flows across them
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    
     # Bind to 0.0.0.0 to listen on ALL interfaces
     sock.bind(('0.0.0.0', TWAMP_PORT))
-    sock.settimeout(1.0)  # 1 second timeout for checking running flag
+    sock.setblocking(False)
+    return sock
+
+def log_packet(packet_num, addr, seq_num):
+    print(f"[{packet_num}] Reflected to {addr[0]}:{addr[1]} (seq: {seq_num})")
+
+def reflect_one(sock, buf, view, packet_count, verbose):
+    """
+    Reflect a single packet with recvfrom_into()/sendto()
+    
+    Returns: number of packets reflected (0 or 1), or None when the queue is empty
+    """
+    try:
+        # Receive packet
+        nbytes, addr = sock.recvfrom_into(buf)
+    except BlockingIOError:
+        return None
+    except Exception as e:
+        if running:
+            print(f"Error receiving packet: {e}")
+        return None
+    
+    if nbytes < 20:
+        return 0
+    
+    try:
+        # Echo packet back immediately
+        sock.sendto(view[:nbytes], addr)
+    except Exception as e:
+        if running:
+            print(f"Error processing packet: {e}")
+        return 0
+    
+    if verbose:
+        log_packet(packet_count + 1, addr, _SEQ_STRUCT.unpack_from(buf)[0])
+    return 1
+
+def reflect_batch(sock, batch, packet_count, verbose):
+    """
+    Receive up to batch.size packets with one recvmmsg() and echo them
+    back to their senders with sendmmsg()
+    
+    Returns: number of packets reflected, or None when the queue is empty
+    """
+    fd = sock.fileno()
+    msgs, iovs = batch.msgs, batch.iovs
+    
+    received = _recvmmsg(fd, ctypes.addressof(msgs), batch.size, 0, None)
+    if received < 0:
+        err = ctypes.get_errno()
+        if err not in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR) and running:
+            print(f"Error receiving packet: {os.strerror(err)}")
+        return None
+    
+    # Reply from the receive slots, each trimmed to its packet length
+    valid = []
+    for i in range(received):
+        if msgs[i].msg_len >= 20:
+            iovs[i].iov_len = msgs[i].msg_len
+            valid.append(i)
+    
+    if len(valid) == received:
+        out = msgs
+    else:
+        # Leave short packets out of the reply batch
+        out = batch.out
+        for k, i in enumerate(valid):
+            out[k].msg_hdr.msg_name = msgs[i].msg_hdr.msg_name
+            out[k].msg_hdr.msg_namelen = msgs[i].msg_hdr.msg_namelen
+            out[k].msg_hdr.msg_iov = msgs[i].msg_hdr.msg_iov
+    
+    sent = 0
+    failed = []  # positions in valid whose reply was rejected
+    while sent < len(valid):
+        rc = _sendmmsg(fd, ctypes.addressof(out) + sent * sizeof(Mmsghdr), len(valid) - sent, 0)
+        if rc > 0:
+            sent += rc
+            continue
+        
+        err = ctypes.get_errno()
+        if err == errno.EINTR:
+            continue
+        if err in (errno.EAGAIN, errno.EWOULDBLOCK):
+            break  # send buffer full; drop the rest of this batch
+        if verbose and running:
+            print(f"Error processing packet: {os.strerror(err)}")
+        failed.append(sent)
+        sent += 1  # skip the packet that failed
+    
+    reflected = sent - len(failed)
+    batch.dropped += len(valid) - reflected
+    
+    if verbose:
+        # Log only the replies that actually went out
+        n = packet_count
+        for k in range(sent):
+            if k in failed:
+                continue
+            i = valid[k]
+            sin = batch.addrs[i]
+            addr = (socket.inet_ntoa(bytes(sin.sin_addr)), socket.ntohs(sin.sin_port))
+            seq_num = _SEQ_STRUCT.unpack_from(batch.bufs, i * RECV_BUF_SIZE)[0]
+            n += 1
+            log_packet(n, addr, seq_num)
+    
+    # Re-arm only the slots this call used; the rest are still untouched
+    for i in range(received):
+        msgs[i].msg_hdr.msg_namelen = sizeof(SockaddrIn)
+        iovs[i].iov_len = RECV_BUF_SIZE
+    
+    return reflected
+
+def reflect(sock, verbose=False):
+    """
+    Reflect packets received on sock until shutdown
+    
+    Returns: number of packets reflected
+    """
+    sel = selectors.DefaultSelector()
+    sel.register(sock, selectors.EVENT_READ)
     
-    print("Reflector started successfully")
-    print("Press Ctrl+C to stop\n")
+    # Batched syscalls where libc has them, else one packet at a time
+    # into a preallocated receive buffer
+    batch = None
+    if _recvmmsg is not None and _sendmmsg is not None:
+        batch = MmsgBatch()
+    buf = bytearray(RECV_BUF_SIZE)
+    view = memoryview(buf)
     
     packet_count = 0
+    t0 = time.monotonic()
     
     try:
         while running:
-            try:
-                # Receive packet
-                data, addr = sock.recvfrom(1024)
-                
-                if len(data) < 20:
-                    continue
-                
-                packet_count += 1
-                
-                # Parse sequence number from packet
-                seq_num = struct.unpack('!I', data[0:4])[0]
-                
-                # Echo packet back immediately
-                sock.sendto(data, addr)
+            # 1 second timeout for checking running flag
+            if not sel.select(1.0):
+                continue
+            
+            # Drain every queued packet before waiting again
+            while True:
+                if batch is not None:
+                    reflected = reflect_batch(sock, batch, packet_count, verbose)
+                else:
+                    reflected = reflect_one(sock, buf, view, packet_count, verbose)
+                if reflected is None:
+                    break
                 
-                print(f"[{packet_count}] Reflected to {addr[0]}:{addr[1]} (seq: {seq_num})")
+                last_count = packet_count
+                packet_count += reflected
                 
-            except socket.timeout:
-                # Timeout is normal, just check if we should continue
-                continue
-            except Exception as e:
-                if running:
-                    print(f"Error processing packet: {e}")
+                if not verbose and (packet_count >> 10) != (last_count >> 10):
+                    # Periodic rate summary instead of a line per packet
+                    dropped = batch.dropped if batch is not None else 0
+                    print(f"[{packet_count}] pps={packet_count / (time.monotonic() - t0):.0f} "
+                          f"dropped={dropped}")
     
     finally:
+        if batch is not None and batch.dropped:
+            print(f"Replies dropped: {batch.dropped}")
+        view.release()
+        sel.close()
         sock.close()
-        print(f"\nReflector stopped. Total packets reflected: {packet_count}")
+    
+    return packet_count
+
+def run_worker(worker_id, verbose):
+    """Forked worker process: reflect on its own socket, then exit"""
+    status = 0
+    try:
+        packet_count = reflect(open_reflector_socket(), verbose)
+        print(f"Worker {worker_id} stopped. Packets reflected: {packet_count}")
+    except Exception as e:
+        print(f"Worker {worker_id} error: {e}")
+        status = 1
+    finally:
+        sys.stdout.flush()
+        os._exit(status)
+
+def main():
+    parser = argparse.ArgumentParser(description='TWAMP Light reflector')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                       help='Log every reflected packet')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                       help='Reflector processes sharing the port via SO_REUSEPORT (default: 1)')
+    
+    args = parser.parse_args()
+    
+    if args.workers < 1:
+        print("Error: Worker count must be >= 1")
+        return 1
+    
+    print("=== TWAMP Light Reflector ===")
+    print(f"Listening on 0.0.0.0:{TWAMP_PORT} (all interfaces)\n")
+    
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+    
+    # Create UDP socket
+    sock = open_reflector_socket()
+    
+    children = []
+    packet_count = 0
+    try:
+        # Fork the remaining workers; each binds its own socket to the same port.
+        # Inside the try so workers already started are stopped if a fork fails.
+        sys.stdout.flush()
+        for worker_id in range(1, args.workers):
+            try:
+                pid = os.fork()
+            except OSError as e:
+                print(f"Error starting worker {worker_id}: {e}")
+                sock.close()
+                return 1
+            if pid == 0:
+                sock.close()
+                run_worker(worker_id, args.verbose)
+            children.append(pid)
+        
+        print(f"Reflector started successfully ({args.workers} worker(s))")
+        print("Press Ctrl+C to stop\n")
+        
+        packet_count = reflect(sock, args.verbose)
+    
+    finally:
+        # Stop and reap the other workers
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in children:
+            os.waitpid(pid, 0)
+        
+        if children:
+            print(f"\nWorker 0 stopped. Packets reflected: {packet_count}")
+            print("Reflector stopped.")
+        else:
+            print(f"\nReflector stopped. Total packets reflected: {packet_count}")
     
     return 0
 